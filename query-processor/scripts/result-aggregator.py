@@ -1,17 +1,181 @@
 #!/usr/bin/python3
 
 import csv
+import json
 import sys
 import os
+import mmap
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 # total time given for the execution of a single query
 TIMEOUT_IN_SECONDS = 600
 # period of reporting, i.e., actual execution time between each row
 REPORTING_PERIOD_IN_SECONDS = 5
+# number of bytes read from the end of a file to locate its last row
+TAIL_READ_SIZE = 65536
+# number of bytes scanned at once while counting rows of a file
+SCAN_CHUNK_SIZE = 1 << 20
+# file next to the aggregated results that stores the rows of previously aggregated folders
+CACHE_FILE_NAME = '.aggregator_cache.json'
+# version of the output rows, increase it whenever the way rows are computed changes
+CACHE_VERSION = 1
+# metric files of a run, a folder is aggregated again if any of them changes
+METRIC_FILES = ['batch-size.csv', 'total-size.csv', 'batch-latency.csv',
+                'total-latency.csv', 'total-time.csv', 'memory.csv']
 
 def get_immediate_subdirectories(a_dir):
-    return [name for name in os.listdir(a_dir)
-            if os.path.isdir(os.path.join(a_dir, name))]
+    # entry types come with the directory listing, so no stat call per entry is needed
+    with os.scandir(a_dir) as entries:
+        return [entry.name for entry in entries if entry.is_dir()]
+
+def read_last_row(path):
+    # only the tail of the file is read, metric files grow by one row per reporting period
+    # the tail is fetched with a single positioned read, without buffering or seeking
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        length = min(size, TAIL_READ_SIZE)
+        tail = os.pread(fd, length, size - length)
+    finally:
+        os.close(fd)
+    lines = [line for line in tail.split(b'\n') if line.strip()]
+    if not lines:
+        raise ValueError('{} is empty'.format(path))
+    # metric files only contain numeric fields, so there is no quoting to handle
+    return lines[-1].decode().strip().split(',')
+
+def read_slide_counts(path):
+    # returns the last row of the batch size histogram and the line number of the
+    # last slide that reported new numbers, i.e., the first of the trailing rows
+    # that share the final slide count
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError('{} is empty'.format(path))
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            end = len(mm)
+            while end > 0 and mm[end - 1] in b'\r\n':
+                end -= 1
+            if end == 0:
+                raise ValueError('{} is empty'.format(path))
+
+            # the last row gives the final slide count
+            run_start = mm.rfind(b'\n', 0, end) + 1
+            last_row = mm[run_start:end].decode().strip().split(',')
+            slide_count = last_row[1].encode()
+
+            # walk backwards over the rows while they report the final slide count,
+            # only the count field of these rows is compared, without decoding
+            end = run_start - 1
+            while end > 0:
+                start = mm.rfind(b'\n', 0, end) + 1
+                fields = mm[start:end].split(b',', 2)
+                if len(fields) < 2 or fields[1].strip() != slide_count:
+                    break
+                run_start = start
+                end = start - 1
+
+            # line number of the first row of the run
+            last_slide_count = 1
+            for offset in range(0, run_start, SCAN_CHUNK_SIZE):
+                last_slide_count += mm[offset:min(offset + SCAN_CHUNK_SIZE, run_start)].count(b'\n')
+
+    return last_row, last_slide_count
+
+def process_folder(results_folder, log_folder):
+    # aggregate the metrics of a single run into an output row, returns None if the metrics cannot be read
+    # path of the folder with a trailing separator, metric file names are appended to it
+    folder_path = os.path.join(results_folder, log_folder, '')
+    batch_size_histogram = folder_path + 'batch-size.csv'
+    total_size_histogram = folder_path + 'total-size.csv'
+    batch_latency_histogram = folder_path + 'batch-latency.csv'
+    total_latency_histogram = folder_path + 'total-latency.csv'
+    total_time_counter = folder_path + 'total-time.csv'
+    memory_counter = folder_path + 'memory.csv'
+
+    print('Opening {}'.format(log_folder))
+
+    try:
+        row, last_slide_count = read_slide_counts(batch_size_histogram)
+        slide_count = int(row[1])
+        slide_size_mean = int(row[2])
+        slide_size_p99 = row[7]
+
+        row = read_last_row(total_size_histogram)
+        total_slide_size_mean = row[2]
+        total_slide_size_p99 = row[7]
+
+        row = read_last_row(batch_latency_histogram)
+        processed_mean = row[2]
+        processed_p99 = row[7]
+
+        row = read_last_row(total_latency_histogram)
+        total_mean = row[2]
+        total_p99 = row[7]
+
+        row = read_last_row(memory_counter)
+        memory = row[0]
+
+        # there won't be time counter for processes that are killed due to a timeout
+        try:
+            row = read_last_row(total_time_counter)
+            time = int(row[2])
+        except:
+            time = TIMEOUT_IN_SECONDS
+
+        exec_name, query_name, bindings, window_size, slide_size, thread_count = log_folder.split('#')[:6]
+        window_size = int(window_size)
+        slide_size = int(slide_size)
+
+        print('Result aggregated for {}'.format(log_folder))
+
+        # values are in the order of the output file header
+        return (
+            query_name,
+            exec_name,
+            bindings,
+            window_size,
+            slide_size,
+            slide_count,
+            slide_size_mean,
+            slide_size_p99,
+            processed_mean,
+            processed_p99,
+            total_slide_size_mean,
+            total_slide_size_p99,
+            total_mean,
+            total_p99,
+            slide_count * slide_size_mean / time,
+            time,
+            last_slide_count * REPORTING_PERIOD_IN_SECONDS,
+            memory
+        )
+
+    except Exception as e:
+        print('Error reading values from {}: {}'.format(log_folder, e))
+        return None
+
+def get_metric_files_signature(folder_path):
+    # modification times of the metric files, None for the ones that do not exist
+    signature = []
+    for metric_file in METRIC_FILES:
+        try:
+            signature.append(os.stat(os.path.join(folder_path, metric_file)).st_mtime_ns)
+        except OSError:
+            signature.append(None)
+    return signature
+
+def process_folder_cached(results_folder, cache, log_folder):
+    # returns the cache key, the signature of the metric files and the output row of a folder,
+    # the row is taken from the cache if none of the metric files changed since it was aggregated
+    folder_path = os.path.abspath(os.path.join(results_folder, log_folder))
+    signature = get_metric_files_signature(folder_path)
+    cached = cache.get(folder_path)
+    if isinstance(cached, list) and len(cached) == 2 and cached[0] == signature:
+        print('Result for {} is unchanged'.format(log_folder))
+        return folder_path, signature, cached[1]
+
+    return folder_path, signature, process_folder(results_folder, log_folder)
 
 # read the command line arguments
 if len(sys.argv) != 3:
@@ -24,103 +188,47 @@ aggregated_results_file = sys.argv[2]
 
 log_folders = get_immediate_subdirectories(results_folder)
 
-with open(aggregated_results_file, 'w') as csv_file:
-    fieldnames = ['query', 'exec', 'binding', 'window-size', 'slide-size', 'slide-count',
-                  'processed-size-mean', 'processed-size-p99', 'processed-mean', 'processed-p99',
-                  'total-size-mean', 'total-size-p99', 'total-mean', 'total-p99',
-                  'throughput', 'total-time', 'last-slide-time', 'memory']
-    writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-    writer.writeheader()
-
-    for log_folder in log_folders:
-        batch_size_histogram = os.path.join(results_folder, log_folder, 'batch-size.csv')
-        total_size_histogram = os.path.join(results_folder, log_folder, 'total-size.csv')
-        batch_latency_histogram = os.path.join(results_folder, log_folder, 'batch-latency.csv')
-        total_latency_histogram = os.path.join(results_folder, log_folder, 'total-latency.csv')
-        total_time_counter = os.path.join(results_folder, log_folder, 'total-time.csv')
-        memory_counter = os.path.join(results_folder, log_folder, 'memory.csv')
-
-        print('Opening {}'.format(log_folder))
+fieldnames = ['query', 'exec', 'binding', 'window-size', 'slide-size', 'slide-count',
+              'processed-size-mean', 'processed-size-p99', 'processed-mean', 'processed-p99',
+              'total-size-mean', 'total-size-p99', 'total-mean', 'total-p99',
+              'throughput', 'total-time', 'last-slide-time', 'memory']
+
+# load the rows of the previous runs of the aggregator, cached rows are only
+# reused if they were produced for the same output format
+cache_file = os.path.join(os.path.dirname(os.path.abspath(aggregated_results_file)), CACHE_FILE_NAME)
+cache_format = [CACHE_VERSION, fieldnames, TIMEOUT_IN_SECONDS, REPORTING_PERIOD_IN_SECONDS]
+try:
+    with open(cache_file, 'r') as f:
+        cache_content = json.load(f)
+except (OSError, ValueError):
+    cache_content = None
+
+cache = {}
+if isinstance(cache_content, dict) and cache_content.get('format') == cache_format \
+        and isinstance(cache_content.get('rows'), dict):
+    cache = cache_content['rows']
 
-        try:
-            with open(batch_size_histogram, 'r') as f:
-                r_list = list(csv.reader(f))
-                row = next(reversed(r_list))
-                slide_count = row[1]
-                slide_size_mean = row[2]
-                slide_size_p99 = row[7]
-                # find the second of the last
-                last_slide_count = 1
-                for row in r_list:
-                    if row[1] == slide_count:
-                        # find the last slide that reported new numbers
-                        break
-                    else:
-                        last_slide_count += 1
-
-            with open(total_size_histogram, 'r') as f:
-                row = next(reversed(list(csv.reader(f))))
-                total_slide_size_mean = row[2]
-                total_slide_size_p99 = row[7]
-
-            with open(batch_latency_histogram, 'r') as f:
-                row = next(reversed(list(csv.reader(f))))
-                processed_mean = row[2]
-                processed_p25 = row[3]
-                processed_p50 = row[4]
-                processed_p75 = row[5]
-                processed_p90 = row[6]
-                processed_p99 = row[7]
-                processed_p999 = row[8]
-
-            with open(total_latency_histogram, 'r') as f:
-                row = next(reversed(list(csv.reader(f))))
-                total_mean = row[2]
-                total_p99 = row[7]
-
-            with open(memory_counter, 'r') as f:
-                row = next(reversed(list(csv.reader(f))))
-                memory = row[0]
-
-            # there won't be time counter for processes that are killed due to a timeout
-            try:
-                with open(total_time_counter, 'r') as f:
-                    row = next(reversed(list(csv.reader(f))))
-                    time = row[2]
-            except:
-                time = TIMEOUT_IN_SECONDS
-
-            exec_name = log_folder.split('#')[0]
-            query_name = log_folder.split('#')[1]
-            bindings = log_folder.split('#')[2]
-            window_size = log_folder.split('#')[3]
-            slide_size = log_folder.split('#')[4]
-            thread_count = log_folder.split('#')[5]
-
-            writer.writerow({
-                'query' : query_name,
-                'exec' : exec_name,
-                'binding' : bindings,
-                'window-size': window_size,
-                'slide-size': slide_size,
-                'slide-count': slide_count,
-                'processed-size-mean' : slide_size_mean,
-                'processed-size-p99' : slide_size_p99,
-                'processed-mean' : processed_mean,
-                'processed-p99' : processed_p99,
-                'total-size-mean' : total_slide_size_mean,
-                'total-size-p99' : total_slide_size_p99,
-                'total-mean': total_mean,
-                'total-p99': total_p99,
-                'throughput' : str(int(slide_count) * int(slide_size_mean) / time),
-                'total-time' : time,
-                'last-slide-time' : str(last_slide_count * REPORTING_PERIOD_IN_SECONDS),
-                'memory': memory
-            })
-
-            print('Result aggregated for {}'.format(log_folder))
-
-        except Exception as e:
-            print('Error reading values from {}: {}'.format(log_folder, e))
+with open(aggregated_results_file, 'w') as csv_file:
+    writer = csv.writer(csv_file)
+    writer.writerow(fieldnames)
+
+    # folders are read concurrently, rows are collected and written at once by this thread
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+        aggregated = [(folder_path, signature, result) for folder_path, signature, result
+                      in executor.map(partial(process_folder_cached, results_folder, cache), log_folders)
+                      if result]
+
+    results = [result for _, _, result in aggregated]
+
+    # sort by query, exec, window size, slide size and binding for a deterministic output,
+    # numeric bindings are compared as numbers and sorted before the others
+    results.sort(key=lambda result: (result[0], result[1], result[3], result[4],
+                                     (0, int(result[2]), '') if result[2].isdigit() else (1, 0, result[2])))
+    writer.writerows(results)
+
+# folders of other results folders are kept, folders that cannot be read are aggregated again next time
+cache.update({folder_path: [signature, list(result)] for folder_path, signature, result in aggregated})
+with open(cache_file, 'w') as f:
+    json.dump({'format': cache_format, 'rows': cache}, f)
 
 print('Aggregated Results written into {}'.format(aggregated_results_file))
@@ -2,11 +2,11 @@
 
 import json
 import os
+import signal
 import sys
 import subprocess
+import threading
 import time
-import psutil
-import csv
 
 class TestRun:
     def __init__(self, exec_name, query_name, input, input_type, report, window_size, slide_size, thread_count, labels):
@@ -21,8 +21,9 @@ class TestRun:
         self.thread_count = thread_count
 
 
-    def produceCommandString(self):
-        command = '{} {} {} {} {} {} {} {} {}'.format(
+    def produceCommandArgs(self):
+        # each argument is passed to the process as is, predicates may contain whitespace
+        return [
             self.exec_name,
             str(self.window_size),
             str(self.slide_size),
@@ -30,11 +31,27 @@ class TestRun:
             self.input,
             self.report_file,
             self.query_name,
-            len(self.predicates),
-            " ".join(self.predicates)
-        )
-
-        return command
+            str(len(self.predicates)),
+            *self.predicates
+        ]
+
+def kill_after_timeout(pid, timeout, lock, finished, killed):
+    # the process is only reaped by the main thread once finished is set under the lock,
+    # so the pid cannot be reused while it is signalled here
+    with lock:
+        if finished.is_set():
+            return
+        # the process already terminated on its own and waits to be reaped
+        if os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None:
+            return
+
+        print('Killing pid {} after timeout {}'.format(str(pid), str(timeout)))
+        sys.stdout.flush()
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            return
+        killed.set()
 
 # read the command line arguments
 if len(sys.argv) != 2:
@@ -61,7 +78,8 @@ with open(parameters, 'r') as parameters_handle:
 
     # global parameters
     dataset_location = parameters_json['dataset']
-    report_folder = parameters_json['report-folder']
+    # trailing separators are dropped, run folder names are appended with a '/'
+    report_folder = parameters_json['report-folder'].rstrip('/')
     timeout = parameters_json['timeout']
     project_base = parameters_json['project-base']
     input_type = parameters_json['input-type']
@@ -78,63 +96,60 @@ with open(parameters, 'r') as parameters_handle:
         thread_count = run_config.get('thread-count', 1)
 
         # reporting folder
-        report_csv_path = os.path.join(report_folder, exec_name + '#' + query_name + '#' + str(index) + '#' + str(window_size) + '#' + str(slide_size) + '#' + str(thread_count))
+        report_csv_path = f'{report_folder}/{exec_name}#{query_name}#{index}#{window_size}#{slide_size}#{thread_count}'
         # create the run object
         run_list.append(TestRun(exec_name, query_name, dataset_location, input_type, report_csv_path, window_size, slide_size, thread_count, predicates))
 
 
+# build every example once, runs then execute the compiled binaries directly
+for exec_name in sorted({run.exec_name for run in run_list}):
+    build_command = ['cargo', 'build', '--release', '--example', exec_name]
+    print('Building {} '.format(' '.join(build_command)))
+    sys.stdout.flush()
+    subprocess.run(build_command, env=env_variables, cwd=project_base or None, check=True)
+
 # iterate over runs and run the experiments
 for run in run_list:
-    argument_string = run.produceCommandString()
-
-    run_command = 'cargo run --release --example {}'.format(argument_string)
+    binary = os.path.join(project_base, 'target', 'release', 'examples', run.exec_name)
+    run_command = [binary, *run.produceCommandArgs()[1:]]
 
-    print('Executing command {} '.format(run_command))
+    print('Executing command {} '.format(' '.join(run_command)))
     sys.stdout.flush()
 
-    elapsedTime = 0
-    interval = 5
+    proc = subprocess.Popen(run_command, env=env_variables)
+
+    # kill the process if it is still alive after timeout
+    lock = threading.Lock()
+    finished = threading.Event()
+    killed = threading.Event()
+    timer = threading.Timer(timeout, kill_after_timeout, args=(proc.pid, timeout, lock, finished, killed))
+    # do not keep the script alive for the timer if it is interrupted
+    timer.daemon = True
+    timer.start()
+
+    try:
+        # wait until program completion or termination without reaping the process
+        os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+        with lock:
+            finished.set()
+        # the kernel reports the peak resident set size of the process (in KiB) once it is reaped
+        _, status, rusage = os.wait4(proc.pid, 0)
+    finally:
+        timer.cancel()
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    max_rss = rusage.ru_maxrss * 1024
+
+    if killed.is_set():
+        # sleep before starting new job for java to release the memory
+        time.sleep(5)
 
-    proc = subprocess.Popen(run_command.split(), env=env_variables)
-
-    ## array to store memory consumption readings
-    memory_rss_readings = []
-
-    # wait until program completion or termination
-    while True:
-        time.sleep(interval)
-        elapsedTime += interval
-
-        # obtain memory usage of the process
-        try:
-            process = psutil.Process(proc.pid)
-            memory_rss_readings.append(process.memory_info().rss)
-        except:
-            print('Process pid {} is already terminated'.format(str(proc.pid)))
-
-        # kill after timeout if process is still alive
-        if elapsedTime > timeout and proc.poll() is None:
-
-            print('Killing pid {} after timeout {}'.format(str(proc.pid), str(timeout)))
-            sys.stdout.flush()
-            proc.kill()
-            # sleep before starting new job for java to release the memory
-            time.sleep(interval)
-            break
-
-        if proc.poll() is not None:
-            break
     # finally report max memory reading in the reporting directory
     if not os.path.exists(run.report_file):
         os.makedirs(run.report_file)
 
-    print('Max memory consumption {}'.format(str(max(memory_rss_readings))))
+    print('Max memory consumption {}'.format(str(max_rss)))
     with open(os.path.join(run.report_file, 'memory.csv'), mode='w') as memory_csv:
-        writer = csv.DictWriter(memory_csv, fieldnames=['max'])
-        writer.writeheader()
-        # write max memory reading
-        writer.writerow({'max' : max(memory_rss_readings) })
-    # close the csv file
-    memory_csv.close()
+        # write max memory reading under a single 'max' column
+        memory_csv.write('max\n{}\n'.format(max_rss))
 
 print('All runs are completed')